@@ -3,11 +3,15 @@ local temp = {}
 local event_sub = {}
 genv.temp = temp
 local url = 'http://127.0.0.1:4343/'
-local proto_version = 3
+local proto_version = 5
 local tasks = {}
 local filters = {}
 local ycounts = {}
 local coparams = {}
+-- called by index without compiling code, see LUA_METHODS in sess.py
+local methods = {
+    function(...) return peripheral.call(...) end,
+}
 
 local ws = http.websocket(url..'ws/')
 if ws == false then
@@ -16,34 +20,41 @@ end
 
 local serialize
 do
-    local function s_rec(v, tracking)
+    local function s_rec(v, tracking, out)
         local t = type(v)
         if v == nil then
-            return 'N'
+            out[#out + 1] = 'N'
         elseif v == false then
-            return 'F'
+            out[#out + 1] = 'F'
         elseif v == true then
-            return 'T'
+            out[#out + 1] = 'T'
         elseif t == 'number' then
-            return '\[' .. tostring(v) .. '\]'
+            out[#out + 1] = '\[' .. tostring(v) .. '\]'
         elseif t == 'string' then
-            return string.format('<%u>', #v) .. v
+            out[#out + 1] = string.format('<%u>', #v)
+            out[#out + 1] = v
         elseif t == 'table' then
             if tracking[v] ~= nil then
                 error('Cannot serialize table with recursive entries', 0)
             end
             tracking[v] = true
-            local r = '{'
+            out[#out + 1] = '{'
             for k, x in pairs(v) do
-                r = r .. ':' .. s_rec(k, tracking) .. s_rec(x, tracking)
+                out[#out + 1] = ':'
+                s_rec(k, tracking, out)
+                s_rec(x, tracking, out)
             end
-            return r .. '}'
+            out[#out + 1] = '}'
         else
             error('Cannot serialize type ' .. t, 0)
         end
-        local tp = type(t)
     end
-    serialize = function(v) return s_rec(v, {}) end
+    -- parts are joined once, repeated concatenation is quadratic
+    serialize = function(v)
+        local out = {}
+        s_rec(v, {}, out)
+        return table.concat(out)
+    end
 end
 
 function create_stream(s, idx)
@@ -108,11 +119,33 @@ function drop_task(task_id)
 end
 
 function ws_send(action, ...)
-    local m = action
+    local m = {action}
     for _, v in ipairs(arg) do
-        m = m .. serialize(v)
+        m[#m + 1] = serialize(v)
+    end
+    ws.send(table.concat(m), true)
+end
+
+function compile_filter(code)
+    -- broken filter is reported and never matches
+    local fn, err = loadstring('return ' .. code)
+    if fn ~= nil then
+        setfenv(fn, genv)
+        local ok, r = pcall(fn)
+        if ok and type(r) == 'function' then return r end
+        err = ok and 'filter is not a function' or r
+    end
+    io.stderr:write('Bad event filter: ' .. tostring(err) .. '\n')
+    return function() return false end
+end
+
+function match_event(sub, ...)
+    if sub == true then return true end
+    for _, fn in ipairs(sub) do
+        local ok, r = pcall(fn, ...)
+        if ok and r then return true end
     end
-    ws.send(m, true)
+    return false
 end
 
 function safe_unpack(a)
@@ -125,6 +158,13 @@ ws_send('0', proto_version, os.getComputerID(), arg)
 while true do
     local event, p1, p2, p3, p4, p5 = os.pullEvent()
 
+    if event == 'peripheral_detach' then
+        -- server drops cached peripheral type,
+        -- wrapped peripheral of get_term_target is dropped here
+        temp['term_target:' .. p1] = nil
+        ws_send('P', p1)
+    end
+
     if event == 'websocket_message' then
         local msg = create_stream(p2)
         local action = msg.fixed(1)
@@ -148,6 +188,17 @@ while true do
                     coparams[task_id] = params
                 end
             end
+        elseif action == 'M' then  -- new task calling registered function
+            local task_id = deserialize(msg)
+            local method_id = deserialize(msg)
+            local fn = methods[method_id]
+            if fn == nil then
+                ws_send('T', task_id, serialize{false, 'Unknown method ' .. tostring(method_id)}, 0)
+            else
+                tasks[task_id] = coroutine.create(fn)
+                ycounts[task_id] = 0
+                coparams[task_id] = deserialize(msg)
+            end
         elseif action == 'D' then  -- drop tasks
             while not msg.isend() do
                 drop_task(deserialize(msg))
@@ -155,7 +206,15 @@ while true do
         elseif action == 'S' or action == 'U' then  -- (un)subscribe to event
             local event = deserialize(msg)
             if action == 'S' then
-                event_sub[event] = true
+                local sub = deserialize(msg)
+                if sub == nil then
+                    sub = true
+                else
+                    for i, code in ipairs(sub) do
+                        sub[i] = compile_filter(code)
+                    end
+                end
+                event_sub[event] = sub
             else
                 event_sub[event] = nil
             end
@@ -168,7 +227,7 @@ while true do
         end
     elseif event == 'websocket_closed' then
         error('Connection with server has been closed')
-    elseif event_sub[event] == true then
+    elseif event_sub[event] ~= nil and match_event(event_sub[event], p1, p2, p3, p4, p5) then
         ws_send('E', event, {p1, p2, p3, p4, p5})
     end
 
@@ -16,6 +16,8 @@ def lua_table_to_list(x, length: int = None, low_index: int = 1):
 
 
 class ResultProc:
+    __slots__ = ('_v', '_i')
+
     def __init__(self, result):
         self._v = result
         self._i = 1
@@ -30,8 +32,8 @@ class ResultProc:
         return self._v.get(self._i)
 
     def take(self):
-        r = self.peek()
-        self.forward()
+        r = self._v.get(self._i)
+        self._i += 1
         return r
 
     def take_none(self):
@@ -56,6 +58,27 @@ class ResultProc:
         assert not isinstance(x, bool)
         return x
 
+    def take_n(self, n: int) -> tuple:
+        # all n values are read in one pass into a tuple of known size
+        r = tuple(map(self._v.get, range(self._i, self._i + n)))
+        self._i += n
+        return r
+
+    def take_ints(self, n: int):
+        x = self.take_n(n)
+        assert all(isinstance(v, int) and not isinstance(v, bool) for v in x)
+        return x
+
+    def take_numbers(self, n: int):
+        x = self.take_n(n)
+        assert all(isinstance(v, (int, float)) and not isinstance(v, bool) for v in x)
+        return x
+
+    def take_strings(self, n: int):
+        x = self.take_n(n)
+        assert all(isinstance(v, bytes) for v in x)
+        return tuple(map(ser.decode, x))
+
     def take_bytes(self):
         x = self.take()
         assert isinstance(x, bytes)
@@ -119,6 +142,11 @@ class ResultProc:
         assert all(map(lambda v: isinstance(v, bytes), x))
         return [ser.decode(v) for v in x]
 
+    def take_list_of_ints(self, length: int = None):
+        x = self.take_list(length)
+        assert all(isinstance(v, int) and not isinstance(v, bool) for v in x)
+        return x
+
     def take_2d_int(self):
         x = self.take_list()
         x = [lua_table_to_list(item) for item in x]
@@ -129,6 +157,8 @@ class ResultProc:
 
 
 class TableProc(ResultProc):
+    __slots__ = ('_keys',)
+
     def __init__(self, result, keys):
         self._v = result
         self._keys = keys
@@ -136,3 +166,77 @@ class TableProc(ResultProc):
 
     def peek(self):
         return self._v.get(self._keys[self._i])
+
+    def take(self):
+        r = self.peek()
+        self._i += 1
+        return r
+
+    def take_n(self, n: int) -> tuple:
+        r = tuple(map(self._v.get, self._keys[self._i:self._i + n]))
+        self._i += n
+        return r
+
+
+class DeferredValue:
+    # placeholder returned by calls queued in a batch, filled on flush
+    def __init__(self, source, index, multi=False):
+        self._source = source
+        self._index = index
+        # holds tuple of several results, see _MULTI_TAKES
+        self._multi = multi
+        self._ready = False
+        self._value = None
+
+    def _set(self, value):
+        self._value = value
+        self._ready = True
+
+    @property
+    def ready(self):
+        return self._ready
+
+    @property
+    def value(self):
+        if not self._ready:
+            raise RuntimeError('Value is not available until the batch is flushed')
+        return self._value
+
+    def encode(self, *args):
+        # reached from ser.encode & co when parameter of batched call is encoded
+        if self._ready:
+            return self._value.encode(*args)
+        raise ValueError('Deferred value can be passed only to parameters sent as is, not encoded')
+
+
+# takes consuming several values, first argument is the count
+_MULTI_TAKES = frozenset(('take_n', 'take_ints', 'take_numbers', 'take_strings'))
+
+
+class DeferredResultProc:
+    # records take_* calls and replays them over the real result later
+    def __init__(self, call_id):
+        self._call_id = call_id
+        self._takes = []
+        self._i = 1
+        self._resolved = False
+
+    def __getattr__(self, name):
+        if not name.startswith('take'):
+            raise AttributeError(name)
+
+        def take(*args):
+            if self._resolved:
+                raise RuntimeError('Result must be parsed inside the batch it was called in')
+            multi = name in _MULTI_TAKES
+            dv = DeferredValue(self, self._i, multi)
+            self._i += args[0] if multi else 1
+            self._takes.append((name, args, dv))
+            return dv
+        return take
+
+    def resolve(self, result):
+        self._resolved = True
+        rp = ResultProc(result)
+        for name, args, dv in self._takes:
+            dv._set(getattr(rp, name)(*args))
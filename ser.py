@@ -1,4 +1,4 @@
-from typing import Any, Tuple
+from typing import Any, Iterable, Sequence, Tuple
 
 from . import lua
 
@@ -32,36 +32,88 @@ def decode(b):
     return b.decode(_ENC)
 
 
-def serialize(v: Any) -> bytes:
+class Serialized:
+    # value in already serialized form, written as is
+    __slots__ = ('data',)
+
+    def __init__(self, data: bytes):
+        self.data = data
+
+
+def _serialize_into(buf: bytearray, v: Any):
     if v is None:
-        return b'N'
+        buf += b'N'
     elif v is False:
-        return b'F'
+        buf += b'F'
     elif v is True:
-        return b'T'
+        buf += b'T'
     elif isinstance(v, (int, float)):
-        return '[{}]'.format(v).encode(_ENC)
+        buf += '[{}]'.format(v).encode(_ENC)
     elif isinstance(v, bytes):
-        return '<{}>'.format(len(v)).encode(_ENC) + v
+        buf += b'<%d>' % len(v)
+        buf += v
     elif isinstance(v, str):
         raise ValueError('Strings are not allowed for serialization')
     elif isinstance(v, (list, tuple)):
-        items = []
+        buf += b'{'
         for k, x in enumerate(v, start=1):
-            items.append(b':' + serialize(k) + serialize(x))
-        return b'{' + b''.join(items) + b'}'
+            buf += b':[%d]' % k
+            _serialize_into(buf, x)
+        buf += b'}'
     elif isinstance(v, dict):
-        items = []
+        buf += b'{'
         for k, x in v.items():
-            items.append(b':' + serialize(k) + serialize(x))
-        return b'{' + b''.join(items) + b'}'
+            buf += b':'
+            _serialize_into(buf, k)
+            _serialize_into(buf, x)
+        buf += b'}'
+    elif isinstance(v, Serialized):
+        buf += v.data
     elif isinstance(v, lua.LuaExpr):
-        e = 'return ' + v.get_expr_code()
-        return 'E{}>'.format(len(e)).encode(_ENC) + e.encode(_ENC)
+        e = ('return ' + v.get_expr_code()).encode(_ENC)
+        buf += b'E%d>' % len(e)
+        buf += e
     else:
         raise ValueError('Value can\'t be serialized: {}'.format(repr(v)))
 
 
+def serialize(v: Any) -> bytes:
+    buf = bytearray()
+    _serialize_into(buf, v)
+    return bytes(buf)
+
+
+def serialize_args(prepend: tuple, name: bytes, params: tuple) -> bytes:
+    # same as serialize((*prepend, name, *params)), written into one buffer
+    buf = bytearray(b'{')
+    k = 0
+    for k, x in enumerate(prepend, start=1):
+        buf += b':[%d]' % k
+        _serialize_into(buf, x)
+    k += 1
+    buf += b':[%d]<%d>' % (k, len(name))
+    buf += name
+    for k, x in enumerate(params, start=k + 1):
+        buf += b':[%d]' % k
+        _serialize_into(buf, x)
+    buf += b'}'
+    return bytes(buf)
+
+
+def serialize_records(names: Sequence[bytes], rows: Iterable[Sequence]) -> Serialized:
+    # list of tables sharing the same keys, keys are serialized once
+    keys = [b':' + serialize(n) for n in names]
+    buf = bytearray(b'{')
+    for i, row in enumerate(rows, start=1):
+        buf += b':[%d]{' % i
+        for k, v in zip(keys, row):
+            buf += k
+            _serialize_into(buf, v)
+        buf += b'}'
+    buf += b'}'
+    return Serialized(bytes(buf))
+
+
 def _deserialize(b: bytes, _idx: int) -> Tuple[Any, int]:
     tok = b[_idx]
     _idx += 1
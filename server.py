@@ -12,7 +12,7 @@ from .rproc import lua_table_to_list
 
 THIS_DIR = dirname(abspath(__file__))
 LUA_FILE = join(THIS_DIR, 'back.lua')
-LUA_FILE_VERSION = 3
+LUA_FILE_VERSION = 5
 PROTO_ERROR = b'C' + ser.serialize(b'protocol error')
 DEBUG_PROTO = False
 
@@ -82,6 +82,8 @@ class CCApplication(web.Application):
                         next(msg),
                         next(msg),
                     )
+                elif action == b'P':
+                    sess.drop_peripheral_types(next(msg))
                 else:
                     await self._send(ws, PROTO_ERROR)
                     break
@@ -23,6 +23,8 @@ __all__ = (
     'CCSession',
     'get_current_session',
     'eval_lua',
+    'eval_lua_args',
+    'eval_lua_method',
     'lua_context_object',
 )
 
@@ -137,6 +139,11 @@ sys.stderr = StdFileProxy(sys.__stderr__, True)
 
 
 def eval_lua(lua_code, *params, immediate=False):
+    return eval_lua_args(lua_code, params, immediate=immediate)
+
+
+def eval_lua_args(lua_code, params: tuple, immediate=False):
+    # same as eval_lua, but takes already packed params
     if isinstance(lua_code, str):
         lua_code = ser.encode(lua_code)
     request = (
@@ -151,6 +158,22 @@ def eval_lua(lua_code, *params, immediate=False):
     return rp
 
 
+# functions registered by back.lua in methods table,
+# they can be called by index without compiling lua code
+LUA_METHODS = {
+    'peripheral.call': 1,
+}
+
+
+def eval_lua_method(method_id: int, args: bytes):
+    # args is already serialized parameters table, see ser.serialize_args
+    request = b'M' + ser.serialize(method_id) + args
+    result = get_current_session()._server_greenlet.switch(request)
+    rp = rproc.ResultProc(ser.deserialize(result))
+    rp.check_bool_error()
+    return rp
+
+
 @contextmanager
 def lua_context_object(create_expr: str, create_params: tuple, finalizer_template: str = ''):
     sess = get_current_session()
@@ -242,29 +265,51 @@ class CCGreenlet:
 
 
 class CCEventRouter:
-    def __init__(self, on_first_sub, on_last_unsub, resume_task):
+    def __init__(self, on_sub, on_last_unsub, resume_task):
         self._stacks = {}
+        self._filters = {}
+        self._sent_filters = {}
         self._active = {}
-        self._on_first_sub = on_first_sub
+        self._on_sub = on_sub
         self._on_last_unsub = on_last_unsub
         self._resume_task = resume_task
 
-    def sub(self, task_id, event):
+    def sub(self, task_id, event, lua_filter=None):
         if event not in self._stacks:
             self._stacks[event] = {}
-            self._on_first_sub(event)
+            self._filters[event] = {}
         se = self._stacks[event]
         if task_id in se:
             raise Exception('Same task subscribes to the same event twice')
         se[task_id] = deque()
+        self._filters[event][task_id] = lua_filter
+        self._update_filters(event)
 
     def unsub(self, task_id, event):
         if event not in self._stacks:
             return
         self._stacks[event].pop(task_id, None)
+        self._filters[event].pop(task_id, None)
         if len(self._stacks[event]) == 0:
             self._on_last_unsub(event)
             del self._stacks[event]
+            del self._filters[event]
+            del self._sent_filters[event]
+        else:
+            self._update_filters(event)
+
+    def _update_filters(self, event):
+        # computer forwards the event if any of the filters passes,
+        # None means that some task wants all events
+        filters = self._filters[event].values()
+        if None in filters:
+            filters = None
+        else:
+            filters = tuple(sorted(set(filters)))
+        if event in self._sent_filters and self._sent_filters[event] == filters:
+            return
+        self._sent_filters[event] = filters
+        self._on_sub(event, filters)
 
     def on_event(self, event, params):
         if event not in self._stacks:
@@ -284,6 +329,14 @@ class CCEventRouter:
             self._set_task_status(task_id, event, True)
             return None
 
+    def get_batch_from_stack(self, task_id, event, max_n):
+        assert max_n >= 1
+        queue = self._stacks[event][task_id]
+        if not queue:
+            self._set_task_status(task_id, event, True)
+            return None
+        return [queue.popleft() for _ in range(min(max_n, len(queue)))]
+
     def _set_task_status(self, task_id, event, waits: bool):
         if waits:
             self._active[task_id] = event
@@ -300,8 +353,11 @@ class CCSession:
         self._greenlets = {}
         self._server_greenlet = get_current_greenlet()
         self._program_greenlet = None
+        # prepend params of wrapped peripheral -> (type, isWireless or None),
+        # filled by peripheral.wrap and wrapRemote
+        self._peripheral_types = {}
         self._evr = CCEventRouter(
-            lambda event: self._sender(b'S' + ser.serialize(event)),
+            lambda event, filters: self._sender(b'S' + ser.serialize(event) + ser.serialize(filters)),
             lambda event: self._sender(b'U' + ser.serialize(event)),
             lambda task_id: self._greenlets[task_id].defer_switch('event'),
         )
@@ -316,6 +372,12 @@ class CCSession:
     def on_event(self, event, params):
         self._evr.on_event(event, params)
 
+    def drop_peripheral_types(self, name):
+        # name is side or remote peripheral name, keys are (side,)
+        # or (modem side, b'callRemote', remote name)
+        for k in [k for k in self._peripheral_types if name in (k[0], k[-1])]:
+            del self._peripheral_types[k]
+
     def create_task_id(self):
         return next(self._tid_allocator)
 
@@ -70,8 +70,7 @@ def packRGB(r: float, g: float, b: float) -> int:
 
 
 def unpackRGB(rgb: int) -> Tuple[float, float, float]:
-    rp = method('unpackRGB', rgb)
-    return tuple(rp.take_number() for _ in range(3))
+    return method('unpackRGB', rgb).take_numbers(3)
 
 
 # use these chars for term.blit
@@ -29,8 +29,7 @@ def list() -> List[str]:
 
 
 def getBlockPosition() -> Tuple[int, int, int]:
-    rp = method('getBlockPosition')
-    return tuple(rp.take_int() for _ in range(3))
+    return method('getBlockPosition').take_ints(3)
 
 
 def getBlockInfo(x: int, y: int, z: int) -> dict:
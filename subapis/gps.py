@@ -20,4 +20,4 @@ def locate(timeout: LuaNum = None, debug: bool = None) -> Optional[Tuple[LuaNum,
     rp = method('locate', timeout, debug)
     if rp.peek() is None:
         return None
-    return tuple(rp.take_number() for _ in range(3))
+    return rp.take_numbers(3)
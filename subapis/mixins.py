@@ -5,6 +5,8 @@ from ..lua import LuaExpr
 
 
 class TermMixin:
+    __slots__ = ()
+
     def write(self, text: str):
         return self._method('write', ser.dirty_encode(text)).take_none()
 
@@ -18,8 +20,7 @@ class TermMixin:
         return self._method('clearLine').take_none()
 
     def getCursorPos(self) -> Tuple[int, int]:
-        rp = self._method('getCursorPos')
-        return tuple(rp.take_int() for _ in range(2))
+        return self._method('getCursorPos').take_ints(2)
 
     def setCursorPos(self, x: int, y: int):
         return self._method('setCursorPos', x, y).take_none()
@@ -34,8 +35,7 @@ class TermMixin:
         return self._method('isColor').take_bool()
 
     def getSize(self) -> Tuple[int, int]:
-        rp = self._method('getSize')
-        return tuple(rp.take_int() for _ in range(2))
+        return self._method('getSize').take_ints(2)
 
     def scroll(self, lines: int):
         return self._method('scroll', lines).take_none()
@@ -53,8 +53,7 @@ class TermMixin:
         return self._method('getBackgroundColor').take_int()
 
     def getPaletteColor(self, colorID: int) -> Tuple[float, float, float]:
-        rp = self._method('getPaletteColor', colorID)
-        return tuple(rp.take_number() for _ in range(3))
+        return self._method('getPaletteColor', colorID).take_numbers(3)
 
     def setPaletteColor(self, colorID: int, r: float, g: float, b: float):
         return self._method('setPaletteColor', colorID, r, g, b).take_none()
@@ -15,6 +15,7 @@ __all__ = (
     'setComputerLabel',
     'run',
     'captureEvent',
+    'captureEventBatch',
     'queueEvent',
     'clock',
     'time',
@@ -51,15 +52,33 @@ def run(environment: dict, programPath: str, *args: str):
     return method('run', environment, ser.encode(programPath), *args).take_bool()
 
 
-def captureEvent(event: str):
+def captureEvent(event: str, lua_filter: str = None):
+    # lua_filter is lua function expression, it receives event parameters
+    # and returns true when the event must be delivered
+    # NOTE: events passing filters of other subscribers are delivered too
+    return _capture_event(event, lua_filter, None)
+
+
+def captureEventBatch(event: str, max_n: int = 32, lua_filter: str = None):
+    # same as captureEvent, but yields lists of up to max_n events
+    # that are already received, instead of switching for every event
+    if max_n < 1:
+        raise ValueError('max_n must be positive')
+    return _capture_event(event, lua_filter, max_n)
+
+
+def _capture_event(event, lua_filter, max_n):
     event = ser.encode(event)
     glet = get_current_greenlet().cc_greenlet
     sess = glet._sess
     evr = sess._evr
-    evr.sub(glet._task_id, event)
+    evr.sub(glet._task_id, event, ser.nil_encode(lua_filter))
     try:
         while True:
-            val = evr.get_from_stack(glet._task_id, event)
+            if max_n is None:
+                val = evr.get_from_stack(glet._task_id, event)
+            else:
+                val = evr.get_batch_from_stack(glet._task_id, event, max_n)
             if val is None:
                 res = sess._server_greenlet.switch()
                 assert res == 'event'
@@ -1,372 +1,631 @@
+from contextlib import contextmanager
 from dataclasses import dataclass
-from typing import Dict, Optional, List, Tuple, Type, Any, Union
+from types import MappingProxyType
+from typing import Callable, Dict, Optional, List, Tuple, Any, Union
 
 from .mixins import TermMixin, TermTarget
 from .. import ser
 from ..lua import LuaNum, LuaTable, lua_string
-from ..sess import eval_lua, eval_lua_method_factory
+from ..rproc import DeferredResultProc, DeferredValue
+from ..sess import (
+    LUA_METHODS, eval_lua, eval_lua_args, eval_lua_method, eval_lua_method_factory, get_current_session,
+)
+
+
+@dataclass
+class _BatchCall:
+    call_id: int
+    expr: str
+    params: tuple
+    # parameter position -> (call_id, result index) of earlier call in batch
+    input_from: Dict[int, Tuple[int, int]]
+    result: DeferredResultProc
 
 
 class BasePeripheral:
     # NOTE: is not LuaExpr, you can't pass peripheral as parameter
     # TODO: to fix this we can supply separate lua expr, result of .wrap()
 
+    __slots__ = ('_lua_method_expr', '_prepend_params', '_code', '_method_id', '_batch')
+
+    # encoded names of methods called through _method,
+    # generated wrappers have their name bound already
+    _ENC = {}
+
     def __init__(self, lua_method_expr, *prepend_params):
         self._lua_method_expr = lua_method_expr
         self._prepend_params = prepend_params
+        self._code = ser.encode('return ' + lua_method_expr + '(...)')
+        self._method_id = LUA_METHODS.get(lua_method_expr)
+        self._batch = None
+        super().__init__()
 
     def _method(self, name, *params):
-        code = 'return ' + self._lua_method_expr + '(...)'
-        return eval_lua(code, *self._prepend_params, ser.encode(name), *params)
+        enc_name = self._ENC.get(name)
+        if enc_name is None:
+            enc_name = self._ENC[name] = ser.encode(name)
+        return self._method_enc(enc_name, *params)
+
+    def _method_enc(self, enc_name, *params):
+        if self._batch is not None:
+            return self._queue_method(enc_name, params)
+        if self._method_id is not None:
+            return eval_lua_method(
+                self._method_id, ser.serialize_args(self._prepend_params, enc_name, params))
+        return eval_lua_args(self._code, (*self._prepend_params, enc_name, *params))
+
+    @contextmanager
+    def batch(self):
+        # Method calls inside the block (getItemDetail, pullItems, ...) are
+        # sent to computer in a single request when the block exits.
+        # They return DeferredValue objects, read .value after the block.
+        # Unresolved DeferredValue can be passed as parameter to a later call
+        # if it holds a single result (not getCursorPos-like tuple) and
+        # the parameter is sent as is (not a string encoded by the wrapper),
+        # otherwise ValueError is raised.
+        # Batchable are methods returning parsed values, methods which
+        # act on the result immediately (open, close, wrapRemote, write, ...)
+        # raise RuntimeError inside the block.
+        if self._batch is not None:
+            yield
+            return
+        calls = self._batch = []
+        try:
+            yield
+        finally:
+            self._batch = None
+        if calls:
+            self._flush_batch(calls)
+
+    def _check_not_batched(self, name):
+        if self._batch is not None:
+            raise RuntimeError('{} can\'t be called inside batch()'.format(name))
+
+    def _queue_method(self, enc_name, params):
+        calls = self._batch
+        args = list(self._prepend_params)
+        args.append(enc_name)
+        input_from = {}
+        for p in params:
+            if isinstance(p, DeferredValue):
+                if p.ready:
+                    p = p.value
+                else:
+                    if p._multi:
+                        raise ValueError('Deferred value holding several results can\'t be passed')
+                    src = p._source
+                    if src._call_id > len(calls) or calls[src._call_id - 1].result is not src:
+                        raise ValueError('Deferred value belongs to another batch')
+                    input_from[len(args) + 1] = (src._call_id, p._index)
+                    p = None
+            args.append(p)
+        call_id = len(calls) + 1
+        rp = DeferredResultProc(call_id)
+        calls.append(_BatchCall(call_id, self._lua_method_expr, tuple(args), input_from, rp))
+        return rp
+
+    @staticmethod
+    def _flush_batch(calls):
+        code = ['local c, r = {...}, {}']
+        for call in calls:
+            for pos, (src_id, idx) in call.input_from.items():
+                code.append('c[{}][{}] = r[{}][{}]'.format(call.call_id, pos, src_id, idx))
+            code.append('r[{0}] = {{{1}(table.unpack(c[{0}], 1, {2}))}}'.format(
+                call.call_id, call.expr, len(call.params)))
+        code.append('return r')
+        results = eval_lua('\n'.join(code), *(call.params for call in calls)).take_dict()
+        for call in calls:
+            call.result.resolve(results.get(call.call_id, {}))
+
+    def _eval_chunk(self, body, *params):
+        # Runs lua code on computer, code can use call(name, ...) to invoke
+        # methods of this peripheral, ... inside body are params.
+        # Not queued by batch(), executed immediately.
+        names = ['p{}'.format(i) for i in range(1, len(self._prepend_params) + 1)]
+        code = [
+            'local function call(...) return {}({}) end'.format(
+                self._lua_method_expr, ', '.join(names + ['...'])),
+            'return (function(...)',
+            body,
+            'end)(select({}, ...))'.format(len(names) + 1),
+        ]
+        if names:
+            code.insert(0, 'local {} = ...'.format(', '.join(names)))
+        return eval_lua_args('\n'.join(code), (*self._prepend_params, *params))
 
 
 class CCDrive(BasePeripheral):
+    __slots__ = ()
+
     def isDiskPresent(self) -> bool:
-        return self._method('isDiskPresent').take_bool()
+        return self._method_enc(b'isDiskPresent').take_bool()
 
     def getDiskLabel(self) -> Optional[str]:
-        return self._method('getDiskLabel').take_option_string()
+        return self._method_enc(b'getDiskLabel').take_option_string()
 
     def setDiskLabel(self, label: Optional[str]):
-        return self._method('setDiskLabel', ser.nil_encode(label)).take_none()
+        return self._method_enc(b'setDiskLabel', ser.nil_encode(label)).take_none()
 
     def hasData(self) -> bool:
-        return self._method('hasData').take_bool()
+        return self._method_enc(b'hasData').take_bool()
 
     def getMountPath(self) -> Optional[str]:
-        return self._method('getMountPath').take_option_string()
+        return self._method_enc(b'getMountPath').take_option_string()
 
     def hasAudio(self) -> bool:
-        return self._method('hasAudio').take_bool()
+        return self._method_enc(b'hasAudio').take_bool()
 
     def getAudioTitle(self) -> Optional[Union[bool, str]]:
-        return self._method('getAudioTitle').take_option_string_bool()
+        return self._method_enc(b'getAudioTitle').take_option_string_bool()
 
     def playAudio(self):
-        return self._method('playAudio').take_none()
+        return self._method_enc(b'playAudio').take_none()
 
     def stopAudio(self):
-        return self._method('stopAudio').take_none()
+        return self._method_enc(b'stopAudio').take_none()
 
     def ejectDisk(self):
-        return self._method('ejectDisk').take_none()
+        return self._method_enc(b'ejectDisk').take_none()
 
     def getDiskID(self) -> Optional[int]:
-        return self._method('getDiskID').take_option_int()
+        return self._method_enc(b'getDiskID').take_option_int()
 
 
 class CCMonitor(BasePeripheral, TermMixin):
+    __slots__ = ()
+
     def getTextScale(self) -> int:
-        return self._method('getTextScale').take_int()
+        return self._method_enc(b'getTextScale').take_int()
 
     def setTextScale(self, scale: int):
-        return self._method('setTextScale', scale).take_none()
+        return self._method_enc(b'setTextScale', scale).take_none()
 
 
 class ComputerMixin:
+    __slots__ = ()
+
     def turnOn(self):
-        return self._method('turnOn').take_none()
+        return self._method_enc(b'turnOn').take_none()
 
     def shutdown(self):
-        return self._method('shutdown').take_none()
+        return self._method_enc(b'shutdown').take_none()
 
     def reboot(self):
-        return self._method('reboot').take_none()
+        return self._method_enc(b'reboot').take_none()
 
     def getID(self) -> int:
-        return self._method('getID').take_int()
+        return self._method_enc(b'getID').take_int()
 
     def getLabel(self) -> Optional[str]:
-        return self._method('getLabel').take_option_string()
+        return self._method_enc(b'getLabel').take_option_string()
 
     def isOn(self) -> bool:
-        return self._method('isOn').take_bool()
+        return self._method_enc(b'isOn').take_bool()
 
 
 class CCComputer(BasePeripheral, ComputerMixin):
-    pass
+    __slots__ = ()
 
 
 class CCTurtle(BasePeripheral, ComputerMixin):
-    pass
+    __slots__ = ()
 
 
-@dataclass
 class ModemMessage:
-    reply_channel: int
-    content: Any
-    distance: LuaNum
+    # fields are read on access from modem_message event parameters:
+    # [side, channel, replyChannel, message, distance]
+    __slots__ = ('_evt',)
+
+    def __init__(self, reply_channel: int, content: Any, distance: LuaNum):
+        self._evt = (None, None, reply_channel, content, distance)
+
+    @classmethod
+    def from_event(cls, evt: list) -> 'ModemMessage':
+        # wraps received event as is, without copying its fields
+        msg = cls.__new__(cls)
+        msg._evt = evt
+        return msg
+
+    @property
+    def reply_channel(self) -> int:
+        return self._evt[2]
+
+    @property
+    def content(self) -> Any:
+        return self._evt[3]
+
+    @property
+    def distance(self) -> Optional[LuaNum]:
+        # missing for messages sent from other dimension
+        return self._evt[4] if len(self._evt) > 4 else None
+
+    def __eq__(self, other):
+        if not isinstance(other, ModemMessage):
+            return NotImplemented
+        return (
+            (self.reply_channel, self.content, self.distance)
+            == (other.reply_channel, other.content, other.distance)
+        )
+
+    def __repr__(self):
+        return 'ModemMessage(reply_channel={!r}, content={!r}, distance={!r})'.format(
+            self.reply_channel, self.content, self.distance,
+        )
 
 
 class ModemMixin:
+    # NOTE: classes using this mixin must have _open_channels slot
+    __slots__ = ()
+
+    def __init__(self):
+        super().__init__()
+        # channels opened through this object, used by keep_open receives
+        self._open_channels = set()
+
     def isOpen(self, channel: int) -> bool:
         return self._method('isOpen', channel).take_bool()
 
     def open(self, channel: int):
-        return self._method('open', channel).take_none()
+        self._check_not_batched('open')
+        r = self._method('open', channel).take_none()
+        self._open_channels.add(channel)
+        return r
 
     def close(self, channel: int):
-        return self._method('close', channel).take_none()
+        self._check_not_batched('close')
+        r = self._method('close', channel).take_none()
+        self._open_channels.discard(channel)
+        return r
 
     def closeAll(self):
-        return self._method('closeAll').take_none()
+        self._check_not_batched('closeAll')
+        r = self._method('closeAll').take_none()
+        self._open_channels.clear()
+        return r
 
     def transmit(self, channel: int, replyChannel: int, message: Any):
-        return self._method('transmit', channel, replyChannel, message).take_none()
+        return self._method_enc(b'transmit', channel, replyChannel, message).take_none()
 
     def isWireless(self) -> bool:
-        return self._method('isWireless').take_bool()
+        return self._method_enc(b'isWireless').take_bool()
 
     @property
     def _side(self):
         return self._prepend_params[0]
 
-    def receive(self, channel: int):
-        from .os import captureEvent
-
+    def receive(self, channel: int, keep_open: bool = False):
+        # keep_open=True leaves channel open after receiving,
+        # so repeated receives on the same channel skip open and close requests
+        for evts in self.receive_raw_batch(channel, keep_open=keep_open):
+            for evt in evts:
+                yield ModemMessage.from_event(evt)
+
+    def receive_batch(self, channel: int, max_n: int = 32, keep_open: bool = False):
+        # yields lists of messages already received by computer,
+        # backlog is processed in one step instead of one switch per message
+        for evts in self.receive_raw_batch(channel, max_n, keep_open):
+            yield [ModemMessage.from_event(evt) for evt in evts]
+
+    def receive_raw(self, channel: int, keep_open: bool = False):
+        # yields modem_message event parameters as is:
+        # [side, channel, replyChannel, message, distance]
+        for evts in self.receive_raw_batch(channel, keep_open=keep_open):
+            yield from evts
+
+    def receive_raw_batch(self, channel: int, max_n: int = 32, keep_open: bool = False):
+        from .os import captureEventBatch
+
+        lua_filter = 'function(side, ch) return side == {} and ch == {} end'.format(
+            lua_string(self._side), channel,
+        )
+        # validates max_n before channel is opened
+        batches = captureEventBatch('modem_message', max_n, lua_filter)
+        # channel left open by earlier keep_open receive is reused,
+        # other open channels belong to other programs or other wrappers
+        reuse = keep_open and channel in self._open_channels
         if self.isOpen(channel):
-            raise Exception('Channel is busy')
-
-        self.open(channel)
+            if not reuse:
+                raise Exception('Channel is busy')
+        else:
+            # also reopens channel closed by others since keep_open receive
+            self.open(channel)
         try:
-            for evt in captureEvent('modem_message'):
-                if evt[0] != self._side:
-                    continue
-                if evt[1] != channel:
-                    continue
-                yield ModemMessage(*evt[2:])
+            for evts in batches:
+                # other receivers may let through messages for other channels
+                evts = [evt for evt in evts if evt[0] == self._side and evt[1] == channel]
+                if evts:
+                    yield evts
         finally:
-            self.close(channel)
+            if not keep_open:
+                self.close(channel)
 
 
 class CCWirelessModem(BasePeripheral, ModemMixin):
-    pass
+    __slots__ = ('_open_channels',)
 
 
 class CCWiredModem(BasePeripheral, ModemMixin):
+    __slots__ = ('_open_channels',)
+
     def getNameLocal(self) -> Optional[str]:
-        return self._method('getNameLocal').take_option_string()
+        return self._method_enc(b'getNameLocal').take_option_string()
 
     def getNamesRemote(self) -> List[str]:
-        return self._method('getNamesRemote').take_list_of_strings()
+        return self._method_enc(b'getNamesRemote').take_list_of_strings()
 
     def getTypeRemote(self, peripheralName: str) -> Optional[str]:
-        return self._method('getTypeRemote', ser.encode(peripheralName)).take_option_string()
+        return self._method_enc(b'getTypeRemote', ser.encode(peripheralName)).take_option_string()
 
     def isPresentRemote(self, peripheralName: str) -> bool:
-        return self._method('isPresentRemote', ser.encode(peripheralName)).take_bool()
+        return self._method_enc(b'isPresentRemote', ser.encode(peripheralName)).take_bool()
 
     def wrapRemote(self, peripheralName: str) -> Optional[BasePeripheral]:
         # use instead getMethodsRemote and callRemote
         # NOTE: you can also use peripheral.wrap(peripheralName)
-
-        ptype = self.getTypeRemote(peripheralName)
-        if ptype is None:
-            return None
-
-        return TYPE_MAP[ptype](
-            self._lua_method_expr, *self._prepend_params,
-            b'callRemote', ser.encode(peripheralName),
-        )
+        self._check_not_batched('wrapRemote')
+
+        params = (*self._prepend_params, b'callRemote', ser.encode(peripheralName))
+        cache = get_current_session()._peripheral_types
+        info = cache.get(params)
+        if info is None:
+            # type and modem kind are queried in one request
+            rp = self._eval_chunk('''
+local name = ...
+local t = call('getTypeRemote', name)
+if t == 'modem' then return t, call('callRemote', name, 'isWireless') end
+return t''', params[-1])
+            info = _take_type_info(rp)
+            if info is None:
+                return None
+            cache[params] = info
+
+        return _from_type_info(info, self._lua_method_expr, *params)
 
     # NOTE: for TermTarget use peripheral.get_term_target(peripheralName)
 
 
 class CCPrinter(BasePeripheral):
+    __slots__ = ()
+
     def newPage(self) -> bool:
-        return self._method('newPage').take_bool()
+        return self._method_enc(b'newPage').take_bool()
 
     def endPage(self) -> bool:
-        return self._method('endPage').take_bool()
+        return self._method_enc(b'endPage').take_bool()
 
     def write(self, text: str):
-        return self._method('write', ser.dirty_encode(text)).take_none()
+        return self._method_enc(b'write', ser.dirty_encode(text)).take_none()
 
     def setCursorPos(self, x: int, y: int):
-        return self._method('setCursorPos', x, y).take_none()
+        return self._method_enc(b'setCursorPos', x, y).take_none()
 
     def getCursorPos(self) -> Tuple[int, int]:
-        rp = self._method('getCursorPos')
-        return tuple(rp.take_int() for _ in range(2))
+        return self._method_enc(b'getCursorPos').take_ints(2)
 
     def getPageSize(self) -> Tuple[int, int]:
-        rp = self._method('getPageSize')
-        return tuple(rp.take_int() for _ in range(2))
+        return self._method_enc(b'getPageSize').take_ints(2)
 
     def setPageTitle(self, title: str):
-        return self._method('setPageTitle', ser.encode(title)).take_none()
+        return self._method_enc(b'setPageTitle', ser.encode(title)).take_none()
 
     def getPaperLevel(self) -> int:
-        return self._method('getPaperLevel').take_int()
+        return self._method_enc(b'getPaperLevel').take_int()
 
     def getInkLevel(self) -> int:
-        return self._method('getInkLevel').take_int()
-
-
+        return self._method_enc(b'getInkLevel').take_int()
+
+
+# playNote instrument:
+# https://minecraft.gamepedia.com/Note_Block#Instruments
+# bass
+# basedrum
+# bell
+# chime
+# flute
+# guitar
+# hat
+# snare
+# xylophone
+# iron_xylophone
+# pling
+# banjo
+# bit
+# didgeridoo
+# cow_bell
+# playNote volume 0..3, pitch 0..24
+# playSound volume 0..3, pitch 0..2
 class CCSpeaker(BasePeripheral):
+    __slots__ = ()
+
     def playNote(self, instrument: str, volume: int = 1, pitch: int = 1) -> bool:
-        # instrument:
-        # https://minecraft.gamepedia.com/Note_Block#Instruments
-        # bass
-        # basedrum
-        # bell
-        # chime
-        # flute
-        # guitar
-        # hat
-        # snare
-        # xylophone
-        # iron_xylophone
-        # pling
-        # banjo
-        # bit
-        # didgeridoo
-        # cow_bell
-
-        # volume 0..3
-        # pitch 0..24
-        return self._method('playNote', ser.encode(instrument), volume, pitch).take_bool()
+        return self._method_enc(b'playNote', ser.encode(instrument), volume, pitch).take_bool()
 
     def playSound(self, sound: str, volume: int = 1, pitch: int = 1) -> bool:
-        # volume 0..3
-        # pitch 0..2
-        return self._method('playSound', ser.encode(sound), volume, pitch).take_bool()
+        return self._method_enc(b'playSound', ser.encode(sound), volume, pitch).take_bool()
 
 
 class CCCommandBlock(BasePeripheral):
+    __slots__ = ()
+
     def getCommand(self) -> str:
-        return self._method('getCommand').take_string()
+        return self._method_enc(b'getCommand').take_string()
 
     def setCommand(self, command: str):
-        return self._method('setCommand', ser.encode(command)).take_none()
+        return self._method_enc(b'setCommand', ser.encode(command)).take_none()
 
     def runCommand(self):
-        return self._method('runCommand').take_bool()
+        return self._method_enc(b'runCommand').take_bool()
 
 
 class CCWorkbench(BasePeripheral):
+    __slots__ = ()
+
     def craft(self, quantity: int = 64):
-        return self._method('craft', quantity).take_bool()
+        return self._method_enc(b'craft', quantity).take_bool()
 
 
 class CCInventory(BasePeripheral):
+    __slots__ = ()
+
     def getItemDetail(self, slot: int) -> Optional[dict]:
-        return self._method('getItemDetail', slot).take()
+        return self._method_enc(b'getItemDetail', slot).take()
 
     def list(self) -> Dict[int, dict]:
-        return self._method('list').take_dict()
+        return self._method_enc(b'list').take_dict()
 
     def pullItems(self, fromName: str, fromSlot: int, limit: int = None, toSlot: int = None) -> int:
-        return self._method('pullItems', ser.encode(fromName), fromSlot, limit, toSlot).take_int()
+        return self._method_enc(b'pullItems', ser.encode(fromName), fromSlot, limit, toSlot).take_int()
 
     def pushItems(self, toName: str, fromSlot: int, limit: int = None, toSlot: int = None) -> int:
-        return self._method('pushItems', ser.encode(toName), fromSlot, limit, toSlot).take_int()
+        return self._method_enc(b'pushItems', ser.encode(toName), fromSlot, limit, toSlot).take_int()
 
     def size(self) -> int:
-        return self._method('size').take_int()
+        return self._method_enc(b'size').take_int()
+
+    def listDetailed(self) -> Dict[int, dict]:
+        # getItemDetail of every occupied slot in one request,
+        # prefer this over calling getItemDetail for each slot of list()
+        return self._eval_chunk('''
+local r = {}
+for slot in pairs(call('list')) do
+    r[slot] = call('getItemDetail', slot)
+end
+return r''').take_dict()
+
+    def pullItemsBulk(self, moves: List[Tuple[str, int, Optional[int], Optional[int]]]) -> List[int]:
+        # moves are tuples (fromName, fromSlot, limit, toSlot), limit and toSlot are optional
+        # all moves are done in one request
+        return self._move_items_bulk('pullItems', moves)
+
+    def pushItemsBulk(self, moves: List[Tuple[str, int, Optional[int], Optional[int]]]) -> List[int]:
+        return self._move_items_bulk('pushItems', moves)
+
+    def _move_items_bulk(self, name, moves):
+        moves = [(ser.encode(m[0]), *m[1:]) for m in moves]
+        return self._eval_chunk('''
+local name, moves = ...
+local r = {}
+for i, m in ipairs(moves) do
+    r[i] = call(name, m[1], m[2], m[3], m[4])
+end
+return r''', ser.encode(name), moves).take_list_of_ints(len(moves))
 
 
 class CCWebDisplay(BasePeripheral):
+    __slots__ = ()
+
     def getURL(self) -> str:
-        return self._method('getURL').take_string()
+        return self._method_enc(b'getURL').take_string()
 
     def isLinked(self) -> bool:
-        return self._method('isLinked').take_bool()
+        return self._method_enc(b'isLinked').take_bool()
 
     def getOwner(self) -> Tuple[str, str]:
-        rp = self._method('getOwner')
-        return tuple(rp.take_string() for _ in range(2))
+        return self._method_enc(b'getOwner').take_strings(2)
 
     def getSize(self) -> Tuple[int, int]:
-        rp = self._method('getSize')
-        return tuple(rp.take_int() for _ in range(2))
+        return self._method_enc(b'getSize').take_ints(2)
 
     def getRotation(self) -> int:
-        return self._method('getRotation').take_int()
+        return self._method_enc(b'getRotation').take_int()
 
     def getScreenSide(self) -> str:
-        return self._method('getScreenSide').take_string()
+        return self._method_enc(b'getScreenSide').take_string()
 
     def getResolution(self) -> Tuple[int, int]:
-        rp = self._method('getResolution')
-        return tuple(rp.take_int() for _ in range(2))
+        return self._method_enc(b'getResolution').take_ints(2)
 
     def getScreenPos(self) -> Tuple[int, int, int]:
-        rp = self._method('getScreenPos')
-        return tuple(rp.take_int() for _ in range(3))
+        return self._method_enc(b'getScreenPos').take_ints(3)
 
     def type(self, txt: str):
-        return self._method('type', txt).take_bool()
+        return self._method_enc(b'type', txt).take_bool()
 
     def click(self, x: int, y: int, act: str):
-        return self._method('click', x, y, act).take_bool()
+        return self._method_enc(b'click', x, y, act).take_bool()
 
     def runJS(self, src: str):
-        return self._method('runJS', src).take_bool()
+        return self._method_enc(b'runJS', src).take_bool()
 
     def setURL(self, url: str):
-        return self._method('setURL', url).take_bool()
+        return self._method_enc(b'setURL', url).take_bool()
 
     def setRotation(self, ang: int):
-        return self._method('setRotation', ang).take_bool()
+        return self._method_enc(b'setRotation', ang).take_bool()
 
     def setResolution(self, res_x: int, res_y: int):
-        return self._method('setResolution', res_x, res_y).take_bool()
+        return self._method_enc(b'setResolution', res_x, res_y).take_bool()
 
 
 class CCNBTObserver(BasePeripheral):
+    __slots__ = ()
+
     def readState(self) -> Dict[str, str]:
-        return self._method('readState').take_dict()
+        return self._method_enc(b'readState').take_dict()
 
     def hasState(self, arg: bytes):
-        return self._method('hasState', arg).take_bool()
+        return self._method_enc(b'hasState', arg).take_bool()
 
     def writeState(self, state):
-        return self._method('writeState', state)
+        self._check_not_batched('writeState')
+        return self._method_enc(b'writeState', state)
 
     def readNBT(self) -> str:
-        return self._method('readNBT').take_string()
+        return self._method_enc(b'readNBT').take_string()
 
     def hasNBT(self, nbtKey: str):
-        return self._method('hasNBT', nbtKey.encode('utf-8')).take_bool()
+        return self._method_enc(b'hasNBT', nbtKey.encode('utf-8')).take_bool()
 
     def writeNBT(self, nbt: str):
-        return self._method('writeNBT', nbt.encode('utf-8'))
+        self._check_not_batched('writeNBT')
+        return self._method_enc(b'writeNBT', nbt.encode('utf-8'))
 
 
 class CC3dProjector(BasePeripheral):
-    def write(self, model: list):
-        return self._method('write', model)
+    __slots__ = ()
 
     def clear(self):
-        return self._method('clear')
+        self._check_not_batched('clear')
+        return self._method_enc(b'clear')
+
+    def write(self, model: list):
+        # model is list of dicts or numpy structured array,
+        # array field names become keys of every shape table
+        self._check_not_batched('write')
+        names = getattr(getattr(model, 'dtype', None), 'names', None)
+        if names is not None:
+            model = ser.serialize_records([ser.encode(n) for n in names], model.tolist())
+        return self._method('write', model)
 
 
 class CCManipulator(BasePeripheral):
+    __slots__ = ()
 
     def getBlockMeta(self, x: int, y: int, z: int):
-        return self._method('getBlockMeta', x, y, z).take_dict()
+        return self._method_enc(b'getBlockMeta', x, y, z).take_dict()
 
     def sense(self):
-        return self._method('sense').take_list()
+        return self._method_enc(b'sense').take_list()
 
     def getMetaByID(self, id: bytes):
-        return self._method('getMetaByID', id).take_dict()
+        return self._method_enc(b'getMetaByID', id).take_dict()
 
     def capture(self, pattern: str):
-        return self._method('capture', pattern.encode('utf-8'))
+        self._check_not_batched('capture')
+        return self._method_enc(b'capture', pattern.encode('utf-8'))
 
     def clearCaptures(self):
-        return self._method('clearCaptures')
+        self._check_not_batched('clearCaptures')
+        return self._method_enc(b'clearCaptures')
 
     def say(self, message: str):
-        return self._method('say', message.encode('utf-8'))
+        self._check_not_batched('say')
+        return self._method_enc(b'say', message.encode('utf-8'))
 
     def uncapture(self, pattern: str):
-        return self._method('uncapture', pattern.encode('utf-8'))
-
+        self._check_not_batched('uncapture')
+        return self._method_enc(b'uncapture', pattern.encode('utf-8'))
 
-TYPE_MAP = {}
 
 method = eval_lua_method_factory('peripheral.')
 
@@ -378,7 +637,9 @@ __all__ = (
     'getNames',
     'wrap',
     'registerType',
+    'registered_types',
     'get_term_target',
+    'invalidate_type_cache',
 )
 
 
@@ -396,55 +657,118 @@ def getNames() -> List[str]:
 
 # use instead getMethods and call
 def wrap(side: str) -> Optional[BasePeripheral]:
-    ptype = getType(side)
-    if ptype is None:
-        return None
+    # Types are cached per session and dropped on peripheral_detach,
+    # so a cached side may return a wrapper of removed peripheral
+    # (instead of None) until computer reports the detach.
+    side = ser.encode(side)
+    cache = get_current_session()._peripheral_types
+    info = cache.get((side,))
+    if info is None:
+        # type and modem kind are queried in one request
+        rp = eval_lua('''
+local t = peripheral.getType(...)
+if t == 'modem' then return t, peripheral.call(..., 'isWireless') end
+return t''', side)
+        info = _take_type_info(rp)
+        if info is None:
+            return None
+        cache[(side,)] = info
 
-    m = 'peripheral.call'
+    return _from_type_info(info, 'peripheral.call', side)
 
-    side = ser.encode(side)
-    if ptype == 'modem':
-        if method('call', side, b'isWireless').take_bool():
-            return CCWirelessModem(m, side)
-        else:
-            return CCWiredModem(m, side)
+
+def _take_type_info(rp) -> Optional[Tuple[bytes, Optional[bool]]]:
+    # parses (type, isWireless for modems) of fused type request
+    ptype = rp.take_option_bytes()
+    if ptype is None:
+        return None
+    assert isinstance(ptype, bytes)
+    wireless = rp.take()
+    assert wireless is None or wireless is True or wireless is False
+    return ptype, wireless
+
+
+def _from_type_info(info, lua_method_expr, *prepend_params) -> BasePeripheral:
+    # info is (type, isWireless or None) as stored in type cache
+    ptype, wireless = info
+    if wireless is not None:
+        return _MODEM_CLASSES[wireless](lua_method_expr, *prepend_params)
+    return TYPE_MAP_B.get(ptype, BasePeripheral)(lua_method_expr, *prepend_params)
+
+
+def invalidate_type_cache(side: str = None):
+    # wrap() and wrapRemote() remember peripheral types,
+    # call this after peripheral on the side or remote name (or any) was replaced
+    # without peripheral_detach event, e.g. by another program
+    sess = get_current_session()
+    if side is None:
+        sess._peripheral_types.clear()
     else:
-        return TYPE_MAP[ptype](m, side)
+        sess.drop_peripheral_types(ser.encode(side))
 
 
-def registerType(ptype: str, pcls: Type[BasePeripheral]):
+def registerType(ptype: str, pcls: Callable[..., BasePeripheral]):
     TYPE_MAP[ptype] = pcls
+    TYPE_MAP_B[ser.encode(ptype)] = pcls
+
+
+_MODEM_CLASSES = {True: CCWirelessModem, False: CCWiredModem}
+
+
+def _modem(lua_method_expr, *prepend_params) -> BasePeripheral:
+    # wrap() and wrapRemote() get isWireless together with the type,
+    # this costs a request and is left for direct TYPE_MAP users
+    wireless = BasePeripheral(lua_method_expr, *prepend_params)._method('isWireless').take_bool()
+    return _MODEM_CLASSES[wireless](lua_method_expr, *prepend_params)
 
 
 def get_term_target(side: str) -> TermTarget:
-    return TermTarget('peripheral.wrap({})'.format(
-        lua_string(side),
+    # wrapped peripheral is kept in temp on computer,
+    # so it's not wrapped again on every terminal call,
+    # back.lua drops it on peripheral_detach of the side
+    return TermTarget('''
+(function()
+    local h = temp[{key}]
+    if h == nil or not peripheral.isPresent({side}) then
+        h = peripheral.wrap({side})
+        temp[{key}] = h
+    end
+    return h
+end)()'''.lstrip().format(
+        key=lua_string('term_target:' + side),
+        side=lua_string(side),
     ))
 
 
-registerType('drive', CCDrive)
-registerType('monitor', CCMonitor)
-registerType('computer', CCComputer)
-registerType('turtle', CCTurtle)
-registerType('printer', CCPrinter)
-registerType('speaker', CCSpeaker)
-registerType('command', CCCommandBlock)
-registerType('workbench', CCWorkbench)
-registerType('webdisplays', CCWebDisplay)
-registerType('NBT_Observer', CCNBTObserver)
-registerType('3d_projector', CC3dProjector)
-registerType('manipulator', CCManipulator)
-
-for k in [
-    'chest',
-    'furnace',
-    'barrel',
-    'hopper',
-    'dropper',
-    'dispenser',
-    'blast_furnace',
-    'smoker',
-    'shulker_box',
-    'brewing_stand',
-]:
-    registerType('minecraft:' + k, CCInventory)
+# peripheral type -> constructor accepting (lua_method_expr, *prepend_params)
+TYPE_MAP: Dict[str, Callable[..., BasePeripheral]] = {
+    'modem': _modem,
+    'drive': CCDrive,
+    'monitor': CCMonitor,
+    'computer': CCComputer,
+    'turtle': CCTurtle,
+    'printer': CCPrinter,
+    'speaker': CCSpeaker,
+    'command': CCCommandBlock,
+    'workbench': CCWorkbench,
+    'webdisplays': CCWebDisplay,
+    'NBT_Observer': CCNBTObserver,
+    '3d_projector': CC3dProjector,
+    'manipulator': CCManipulator,
+    'minecraft:chest': CCInventory,
+    'minecraft:furnace': CCInventory,
+    'minecraft:barrel': CCInventory,
+    'minecraft:hopper': CCInventory,
+    'minecraft:dropper': CCInventory,
+    'minecraft:dispenser': CCInventory,
+    'minecraft:blast_furnace': CCInventory,
+    'minecraft:smoker': CCInventory,
+    'minecraft:shulker_box': CCInventory,
+    'minecraft:brewing_stand': CCInventory,
+}
+# same, keyed by encoded type
+TYPE_MAP_B: Dict[bytes, Callable[..., BasePeripheral]] = {
+    ser.encode(k): v for k, v in TYPE_MAP.items()
+}
+# read-only view, use registerType to add types
+registered_types = MappingProxyType(TYPE_MAP)
@@ -59,8 +59,7 @@ setPaletteColor = tapi.setPaletteColor
 
 
 def nativePaletteColor(colorID: int) -> Tuple[float, float, float]:
-    rp = method('nativePaletteColor', colorID)
-    return tuple(rp.take_number() for _ in range(3))
+    return method('nativePaletteColor', colorID).take_numbers(3)
 
 
 @contextmanager
@@ -17,8 +17,7 @@ class CCWindow(BaseSubAPI, TermMixin):
         return self._method('restoreCursor').take_none()
 
     def getPosition(self) -> Tuple[int, int]:
-        rp = self._method('getPosition')
-        return tuple(rp.take_int() for _ in range(2))
+        return self._method('getPosition').take_ints(2)
 
     def reposition(self, x: int, y: int, width: int = None, height: int = None, parent: TermTarget = None):
         return self._method('reposition', x, y, width, height, parent).take_none()